@@ -1,101 +1,417 @@
 import time
 import random
 import os
+import bisect
+from array import array
+import heapq
+from itertools import groupby
+import math
+import mmap
+from operator import itemgetter
+import struct
 from pathlib import Path
 from tqdm import tqdm # type: ignore
 import sys
 
+# Number of records between consecutive fence pointers in the sparse index.
+BLOCK_SIZE = 128
+
+# Progress bars are advanced once per chunk instead of on every operation.
+PROGRESS_CHUNK = 50000
+
+# Precompiled record codecs shared by the writer and every reader.
+# Records are a little-endian signed 64-bit key and a 16-bit value length, followed by the value.
+RECORD_HEADER = struct.Struct("<qH")
+INDEX_ENTRY = struct.Struct("<qq")
+MAX_VALUE_BYTES = 0xFFFF
+MIN_KEY = -(1 << 63)
+MAX_KEY = (1 << 63) - 1
+
+# Odd 64-bit constants for the two multiplicative hashes used by BloomFilter.
+HASH_MULTIPLIER_1 = 0x9E3779B97F4A7C15
+HASH_MULTIPLIER_2 = 0xC2B2AE3D27D4EB4F
+HASH_MASK = (1 << 64) - 1
+
+class BloomFilter:
+    def __init__(self, num_bits, num_hashes):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bytearray((num_bits + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity, error_rate=0.01):
+        """Creates a Bloom filter sized for the given number of keys and false positive rate."""
+        capacity = max(capacity, 1)
+        num_bits = max(int(-capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        num_hashes = max(int(round(num_bits / capacity * math.log(2))), 1)
+        return cls(num_bits, num_hashes)
+
+    def positions(self, key):
+        """Returns the starting bit and the stride for a key, from two multiplicative mixes of the int."""
+        num_bits = self.num_bits
+        h1 = (key * HASH_MULTIPLIER_1 & HASH_MASK) % num_bits
+        h2 = ((key * HASH_MULTIPLIER_2 & HASH_MASK) >> 32 | 1) % num_bits
+        return h1, h2
+
+    def add_all(self, keys):
+        """Adds many keys to the Bloom filter, keeping attribute lookups out of the per-key loop."""
+        bits = self.bits
+        num_bits = self.num_bits
+        num_hashes = range(self.num_hashes)
+        positions = self.positions
+        for key in keys:
+            position, stride = positions(key)
+            for _ in num_hashes:
+                bits[position >> 3] |= 1 << (position & 7)
+                position = (position + stride) % num_bits
+
+    def contains(self, key):
+        """Returns False if the key is definitely absent, True if it may be present."""
+        bits = self.bits
+        position, stride = self.positions(key)
+        for _ in range(self.num_hashes):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+            position = (position + stride) % self.num_bits
+        return True
+
 class SSTable:
     def __init__(self, directory, id):
         self.directory = directory
         self.id = id
-        self.path = f"{directory}/ss_table_{id}.txt"
+        self.path = f"{directory}/ss_table_{id}.dat"
+        self.index_path = f"{directory}/ss_table_{id}.idx"
         self.data = []
         self.deletion_log = set()
+        self.mm = None
+        self.index_keys = None
+        self.index_offsets = None
+        self.min_key = None
+        self.max_key = None
+        self.bloom = None
+        self.bytes_on_disk = 0
 
     def write_to_disk(self):
-        """Writes the data stored in the SSTable instance to a disk file."""
-        with open(self.path, 'w') as f:
-            for key, value in self.data:
-                if value is not None:
-                    f.write(f"{key},{value}\n")
+        """Writes the data stored in the SSTable instance to a binary data file and a sparse index file.
+
+        Each record is an 8-byte key, a 2-byte value length and the value bytes, so values must
+        encode to at most 65535 bytes.
+        Every BLOCK_SIZE records, the first key of the block and its offset are written to the index.
+        """
+        index = []
+        offset = 0
+        count = 0
+        records = []
+        for key, value in self.data:
+            if value is not None:
+                if self.min_key is None:
+                    self.min_key = key
+                self.max_key = key
+                if count % BLOCK_SIZE == 0:
+                    index.append(INDEX_ENTRY.pack(key, offset))
+                encoded = str(value).encode()
+                record = RECORD_HEADER.pack(key, len(encoded)) + encoded
+                records.append(record)
+                offset += len(record)
+                count += 1
+        # One contiguous write instead of a write() call per record.
+        with open(self.path, 'wb', buffering=1 << 20) as f:
+            f.write(b"".join(records))
+            self.bytes_on_disk = f.tell()
+        with open(self.index_path, 'wb') as f:
+            f.write(b"".join(index))
+            self.bytes_on_disk += f.tell()
         self.data.clear()
+        return self.bytes_on_disk
+
+    def may_contain(self, key):
+        """Checks the min/max key fences and the Bloom filter before the data file is searched."""
+        if self.min_key is None or key < self.min_key or key > self.max_key:
+            return False
+        if self.bloom is None:
+            self.bloom = self.build_bloom()
+        return self.bloom.contains(key)
+
+    def build_bloom(self):
+        """Builds a Bloom filter from the keys in the data file.
+
+        Filters are built on the first lookup rather than on write, so SSTables that compaction
+        replaces before they are ever queried never pay for one.
+        """
+        keys = []
+        mm = self.open()
+        if mm is not None:
+            unpack_from = RECORD_HEADER.unpack_from
+            header_size = RECORD_HEADER.size
+            offset = 0
+            end = len(mm)
+            while offset < end:
+                key, length = unpack_from(mm, offset)
+                keys.append(key)
+                offset += header_size + length
+        bloom = BloomFilter.for_capacity(len(keys))
+        bloom.add_all(keys)
+        return bloom
+
+    def open(self):
+        """Memory-maps the data file and loads the sparse index, caching both for later lookups."""
+        if self.index_keys is None:
+            # Fence pointers are cached as typed arrays: 8 bytes per entry and bisect-able.
+            fences = array('q')
+            with open(self.index_path, 'rb') as f:
+                fences.frombytes(f.read())
+            if sys.byteorder == 'big':
+                fences.byteswap()
+            self.index_keys = fences[0::2]
+            self.index_offsets = fences[1::2]
+            if fences:
+                with open(self.path, 'rb') as f:
+                    self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.mm
+
+    def close(self):
+        """Releases the memory map and the cached index."""
+        if self.mm is not None:
+            self.mm.close()
+        self.mm = None
+        self.index_keys = None
+        self.index_offsets = None
 
     def read_from_disk(self):
         """Reads the data from the SSTable disk file and yields key-value pairs."""
-        with open(self.path, 'r') as f:
-            for line in f:
-                key, value = line.strip().split(',')
-                yield int(key), value
+        mm = self.open()
+        if mm is None:
+            return
+        unpack_from = RECORD_HEADER.unpack_from
+        header_size = RECORD_HEADER.size
+        offset = 0
+        end = len(mm)
+        while offset < end:
+            key, length = unpack_from(mm, offset)
+            offset += header_size
+            yield key, mm[offset:offset + length].decode()
+            offset += length
+
+    def seek_block(self, key):
+        """Returns the start and end offsets of the block that would contain the key, using the sparse index."""
+        block = bisect.bisect_right(self.index_keys, key) - 1
+        if block < 0:
+            return 0, 0
+        if block + 1 < len(self.index_offsets):
+            return self.index_offsets[block], self.index_offsets[block + 1]
+        return self.index_offsets[block], len(self.mm)
+
+    def range_iter(self, start_key, end_key):
+        """Yields the key-value pairs within the range, starting at the block that holds start_key."""
+        mm = self.open()
+        if mm is None:
+            return
+        unpack_from = RECORD_HEADER.unpack_from
+        header_size = RECORD_HEADER.size
+        offset, _ = self.seek_block(start_key)
+        end = len(mm)
+        while offset < end:
+            key, length = unpack_from(mm, offset)
+            offset += header_size
+            if key > end_key:
+                break
+            if key >= start_key:
+                yield key, mm[offset:offset + length].decode()
+            offset += length
 
     def delete(self):
-        """Deletes the SSTable file from the disk."""
-        os.remove(self.path)
+        """Deletes the SSTable files from the disk and returns the number of bytes freed."""
+        self.close()
+        freed = 0
+        for path in (self.path, self.index_path):
+            freed += os.stat(path).st_size
+            os.remove(path)
+        self.bytes_on_disk = 0
+        return freed
 
 class LSMTree:
     def __init__(self, memtable_limit=0, max_sstables=5):
         self.memtable = {}
+        # Sorted view of the memtable keys, rebuilt lazily after the memtable changes.
+        self.memtable_keys = None
         self.sstables = []
         self.memtable_limit = memtable_limit
         self.max_sstables = max_sstables
         self.directory = Path("sstables")
         self.directory.mkdir(exist_ok=True)
         self.sstable_counter = 0
-        self.deletion_log = set()
+        # Bytes used by all SSTable files, kept up to date as SSTables are written and deleted.
+        self.total_bytes = 0
+        # Tombstones are kept as sorted, disjoint, inclusive [start, end] key ranges.
+        self.tombstone_starts = []
+        self.tombstone_ends = []
         self.search_results = {}
         self.range_search_results = {}
 
     def insert(self, key, value):
         """Inserts a key-value pair into the LSMTree."""
-        if key in self.deletion_log:
-            self.deletion_log.remove(key)
+        self.check_key(key)
+        self.check_value(key, value)
+        if self.tombstone_starts:
+            self.remove_tombstone(key)
         self.memtable[key] = value
+        self.memtable_keys = None
         if len(self.memtable) >= self.memtable_limit:
             self.flush_memtable()
 
+    def insert_batch(self, keys, value_fn=str):
+        """Inserts a sequence of keys, computing each value with value_fn and flushing as the memtable fills."""
+        position = 0
+        while position < len(keys):
+            # Never add more keys than the memtable has room for, so flushes happen at the same points as insert().
+            room = max(self.memtable_limit - len(self.memtable), 1)
+            batch = keys[position:position + room]
+            position += len(batch)
+            if min(batch) < MIN_KEY or max(batch) > MAX_KEY:
+                for key in batch:
+                    self.check_key(key)
+            values = list(map(value_fn, batch))
+            # Only non-str values or ones long enough to possibly exceed the limit in UTF-8 need a closer look.
+            if not set(map(type, values)) <= {str} or max(map(len, values)) > MAX_VALUE_BYTES // 4:
+                for key, value in zip(batch, values):
+                    self.check_value(key, value)
+            if self.tombstone_starts:
+                for key in batch:
+                    self.remove_tombstone(key)
+            self.memtable.update(zip(batch, values))
+            self.memtable_keys = None
+            if len(self.memtable) >= self.memtable_limit:
+                self.flush_memtable()
+
+    def check_key(self, key):
+        """Rejects keys that do not fit in the signed 64-bit key field of an SSTable record."""
+        if not MIN_KEY <= key <= MAX_KEY:
+            raise ValueError(f"Key {key} is outside the signed 64-bit range [{MIN_KEY}, {MAX_KEY}]")
+
+    def check_value(self, key, value):
+        """Rejects values that do not fit in an SSTable record before they reach the memtable."""
+        if value is None:
+            return
+        if not isinstance(value, str):
+            # Non-str values are written in their str() form, as the text format always did.
+            value = str(value)
+        # UTF-8 uses at most 4 bytes per character, so short values never need encoding here.
+        if len(value) > MAX_VALUE_BYTES // 4 and len(value.encode()) > MAX_VALUE_BYTES:
+            raise ValueError(f"Value for key {key} is longer than {MAX_VALUE_BYTES} bytes")
+
     def delete(self, key):
         """Marks a key for deletion in the LSMTree."""
-        self.deletion_log.add(key)
+        self.add_tombstone_range(key, key)
         if key in self.memtable:
             del self.memtable[key]
+            self.memtable_keys = None
 
     def delete_range(self, start_key, end_key):
         """Deletes a range of keys from the LSMTree."""
-        for key in tqdm(range(start_key, end_key + 1), desc="Deleting range"):
-            self.delete(key)
+        self.add_tombstone_range(start_key, end_key)
+        memtable_keys = self.sorted_memtable_keys()
+        low = bisect.bisect_left(memtable_keys, start_key)
+        high = bisect.bisect_right(memtable_keys, end_key)
+        if low < high:
+            for key in memtable_keys[low:high]:
+                del self.memtable[key]
+            self.memtable_keys = None
+
+    def add_tombstone_range(self, start_key, end_key):
+        """Records a deleted key range, merging it with any overlapping or adjacent ranges."""
+        if start_key > end_key:
+            return
+        starts = self.tombstone_starts
+        ends = self.tombstone_ends
+        first = bisect.bisect_left(ends, start_key - 1)
+        last = bisect.bisect_right(starts, end_key + 1)
+        if first < last:
+            start_key = min(start_key, starts[first])
+            end_key = max(end_key, ends[last - 1])
+        starts[first:last] = [start_key]
+        ends[first:last] = [end_key]
+
+    def remove_tombstone(self, key):
+        """Removes a single key from the tombstone ranges, splitting the range that covers it."""
+        i = bisect.bisect_right(self.tombstone_starts, key) - 1
+        if i < 0 or self.tombstone_ends[i] < key:
+            return
+        start_key = self.tombstone_starts[i]
+        end_key = self.tombstone_ends[i]
+        starts = []
+        ends = []
+        if start_key < key:
+            starts.append(start_key)
+            ends.append(key - 1)
+        if key < end_key:
+            starts.append(key + 1)
+            ends.append(end_key)
+        self.tombstone_starts[i:i + 1] = starts
+        self.tombstone_ends[i:i + 1] = ends
+
+    def is_deleted(self, key):
+        """Checks whether a key falls inside one of the tombstone ranges."""
+        i = bisect.bisect_right(self.tombstone_starts, key) - 1
+        return i >= 0 and self.tombstone_ends[i] >= key
+
+    def clear_tombstones(self):
+        """Drops all tombstone ranges once deleted keys have been compacted away."""
+        self.tombstone_starts = []
+        self.tombstone_ends = []
+
+    def sorted_memtable_keys(self):
+        """Returns the memtable keys in sorted order, sorting only if the memtable changed."""
+        if self.memtable_keys is None:
+            self.memtable_keys = sorted(self.memtable)
+        return self.memtable_keys
 
     def flush_memtable(self):
         """Flushes the memtable to a new SSTable when the memtable limit is reached."""
-        sorted_memtable = sorted(self.memtable.items(), key=lambda x: x[0])
-        
-        new_sstable = SSTable(self.directory, self.sstable_counter)
-        new_sstable.data = [(k, v) for k, v in sorted_memtable if k not in self.deletion_log]
-        new_sstable.write_to_disk()
-        self.sstables.append(new_sstable)
+        memtable = self.memtable
+        sorted_memtable = [(k, memtable[k]) for k in self.sorted_memtable_keys()]
+        if self.tombstone_starts:
+            sorted_memtable = [(k, v) for k, v in sorted_memtable if not self.is_deleted(k)]
+
+        self.sstables.append(self.write_sstable(sorted_memtable))
         self.memtable.clear()
-        self.sstable_counter += 1
+        self.memtable_keys = None
         self.compact_sstables()
 
     def compact_sstables(self):
         """Compacts SSTables when the maximum number of SSTables is exceeded."""
         if len(self.sstables) > self.max_sstables:
-            merged_data = {}
-            for sstable in self.sstables:
-                for key, value in sstable.read_from_disk():
-                    if key not in self.deletion_log:
-                        merged_data[key] = value
+            # SSTables are sorted on disk, so stream a k-way merge instead of rebuilding a dict.
+            # Iterating newest-first means the first occurrence of each key is the latest value.
+            iterators = [sstable.read_from_disk() for sstable in reversed(self.sstables)]
+            merged = heapq.merge(*iterators, key=lambda item: item[0])
+            compacted = []
+            chunk = []
+            previous_key = None
+            has_tombstones = bool(self.tombstone_starts)
+            for key, value in merged:
+                if key == previous_key:
+                    continue
+                previous_key = key
+                if has_tombstones and self.is_deleted(key):
+                    continue
+                chunk.append((key, value))
+                if len(chunk) >= self.memtable_limit:
+                    compacted.append(self.write_sstable(chunk))
+                    chunk = []
+            if chunk:
+                compacted.append(self.write_sstable(chunk))
             for sstable in self.sstables:
-                sstable.delete()
-            self.sstables.clear()
-            self.deletion_log.clear()
-            sorted_items = sorted(merged_data.items())
-            chunks = [sorted_items[i:i + self.memtable_limit] for i in range(0, len(sorted_items), self.memtable_limit)]
-            for chunk in chunks:
-                new_sstable = SSTable(self.directory, self.sstable_counter)
-                new_sstable.data = chunk
-                new_sstable.write_to_disk()
-                self.sstables.append(new_sstable)
-                self.sstable_counter += 1
+                self.total_bytes -= sstable.delete()
+            self.sstables = compacted
+            self.clear_tombstones()
+
+    def write_sstable(self, data):
+        """Writes a sorted list of key-value pairs to a new SSTable and returns it."""
+        new_sstable = SSTable(self.directory, self.sstable_counter)
+        new_sstable.data = data
+        self.total_bytes += new_sstable.write_to_disk()
+        self.sstable_counter += 1
+        return new_sstable
 
     def enforce_final_compaction(self):
         """Ensures that the final compaction is enforced if necessary."""
@@ -123,17 +439,21 @@ class LSMTree:
         print(f"Time taken to find all keys: {elapsed_time:.4f} seconds")
 
     def search_sstable(self, sstable, key):
-        """Searches for a key in a specific SSTable."""
+        """Searches for a key in a specific SSTable using its sparse index."""
         try:
-            with open(sstable.path, 'r') as file:
-                for line in file:
-                    k, v = line.strip().split(',')
-                    k = int(k)
-                    if k == key:
-                        print(f"Found key {key} in SSTable {sstable.id}")
-                        return v
-                    elif k > key:
-                        break
+            mm = sstable.open()
+            if mm is None:
+                return None
+            offset, end = sstable.seek_block(key)
+            while offset < end:
+                k, length = RECORD_HEADER.unpack_from(mm, offset)
+                offset += RECORD_HEADER.size
+                if k == key:
+                    print(f"Found key {key} in SSTable {sstable.id}")
+                    return mm[offset:offset + length].decode()
+                elif k > key:
+                    break
+                offset += length
         except Exception as e:
             print(f"Error reading SSTable: {e}")
         return None
@@ -145,6 +465,8 @@ class LSMTree:
             print(f"Found key {key} in memory")
             return self.memtable[key]
         for sstable in reversed(self.sstables):
+            if not sstable.may_contain(key):
+                continue
             result = self.search_sstable(sstable, key)
             if result is not None:
                 self.search_results[key] = result
@@ -155,18 +477,25 @@ class LSMTree:
     def range_query(self, start_key, end_key):
         """Performs a range query on the LSMTree and returns all key-value pairs within the specified range."""
         start_time = time.time() 
-        results = {}
-        for key, value in self.memtable.items():
-            if start_key <= key <= end_key:
-                results[key] = value
-        for sstable in self.sstables:
-            for key, value in sstable.read_from_disk():
-                if start_key <= key <= end_key and key not in results:
-                    results[key] = value
+        memtable = self.memtable
+        memtable_keys = self.sorted_memtable_keys()
+        low = bisect.bisect_left(memtable_keys, start_key)
+        high = bisect.bisect_right(memtable_keys, end_key)
+        # Every source is sorted and listed newest-first, so heapq.merge yields the newest
+        # value of each key first and the results come out in key order without a final sort.
+        iterators = [((key, memtable[key]) for key in memtable_keys[low:high])]
+        for sstable in reversed(self.sstables):
+            if sstable.min_key is None or sstable.max_key < start_key or sstable.min_key > end_key:
+                continue
+            iterators.append(sstable.range_iter(start_key, end_key))
+        # Keep the first (newest) pair of each run of equal keys; groupby does the dedup in C.
+        by_key = itemgetter(0)
+        merged = heapq.merge(*iterators, key=by_key)
+        results = [next(group) for _, group in groupby(merged, key=by_key)]
         end_time = time.time()
         time_taken = end_time - start_time
         print(f"Time taken for range query: {time_taken:.4f} seconds")
-        return sorted(results.items())
+        return results
     
     def print_memory_usage(self):
         """Prints the memory usage of the search results."""
@@ -179,13 +508,15 @@ def main():
     # Insertion of random keys
     start_time = time.time()
     random_keys = random.sample(range(10000000), 10000000)  # Generate a list of unique random keys
-    for key in tqdm(random_keys, desc="Inserting keys"):
-        lsm_tree.insert(key, f"value{key}")
+    with tqdm(total=len(random_keys), desc="Inserting keys", mininterval=0.5) as pbar:
+        for i in range(0, len(random_keys), PROGRESS_CHUNK):
+            batch = random_keys[i:i + PROGRESS_CHUNK]
+            lsm_tree.insert_batch(batch, "value{}".format)
+            pbar.update(len(batch))
     print(f"Time taken for insertion: {time.time() - start_time:.4f} seconds")
 
     # Calculate total space used after insertion
-    current_directory = os.getcwd()
-    total_size = sum(os.path.getsize(os.path.join(dirpath, f)) for dirpath, _, filenames in os.walk(current_directory) for f in filenames)
+    total_size = lsm_tree.total_bytes
     initial_size = total_size
 
     print(f"Total space used after insertion: {total_size} bytes")
@@ -197,7 +528,7 @@ def main():
     lsm_tree.enforce_final_compaction()
 
     # Calculate total space used after deletion
-    total_size = sum(os.path.getsize(os.path.join(dirpath, f)) for dirpath, _, filenames in os.walk(current_directory) for f in filenames)
+    total_size = lsm_tree.total_bytes
     print(f"Total space freed by deletion: {initial_size - total_size} bytes")
 
     # Finding keys specified by the user
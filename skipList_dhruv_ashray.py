@@ -1,127 +1,185 @@
 import random
 import time
 import sys
+from array import array
 from tqdm import tqdm # type: ignore
 
-class SkipNode:
-    def __init__(self, key, level, values):
-        self.key = key
-        self.values = values
-        self.forward = [None] * (level + 1)
+# Nodes live in parallel arrays on the SkipList and are referred to by integer id.
+# Id 0 is the header, which never appears as a successor, so it also marks "no next node".
+HEADER = 0
+
+# Size of one node's key slot, values list, forward array (two levels on average) and
+# its slots in the parallel arrays, measured once rather than on every insert/delete.
+_NODE_BYTES = array('q', [0]).itemsize + sys.getsizeof(array('I', [0, 0])) + sys.getsizeof([0, 0, 0]) + 2 * 8
+
+# Number of node values drawn from the RNG in one call, three per node.
+_VALUE_POOL_SIZE = 3 * (1 << 12)
+
+# Progress bars are advanced once per chunk instead of on every operation.
+PROGRESS_CHUNK = 1000
 
 class SkipList:
     def __init__(self, max_level=16, p=0.5):
         self.max_level = max_level
         self.p = p
-        self.header = self.create_node(self.max_level, None, None)
+        self.keys = array('q')
+        self.values = []
+        self.forward = []
+        self.free_ids = []
+        self.create_node(self.max_level)
         self.level = 0
-        self.space_taken = sys.getsizeof(self.header)
+        self.header_bytes = sys.getsizeof(self.forward[HEADER])
         self.size = 0
-
-    def create_node(self, level, key=None, values=None):
-        return SkipNode(key, level, values)
+        self.value_pool = []
+        self.value_index = 0
+
+    @property
+    def space_taken(self):
+        return self.header_bytes + self.size * _NODE_BYTES
+
+    def create_node(self, level, key=0, values=None):
+        forward = array('I', bytes(4 * (level + 1)))
+        if self.free_ids:
+            node = self.free_ids.pop()
+            self.keys[node] = key
+            self.values[node] = values
+            self.forward[node] = forward
+        else:
+            node = len(self.keys)
+            self.keys.append(key)
+            self.values.append(values)
+            self.forward.append(forward)
+        return node
+
+    def next_values(self):
+        if self.value_index >= len(self.value_pool):
+            self.value_pool = random.choices(range(101), k=_VALUE_POOL_SIZE)
+            self.value_index = 0
+        values = self.value_pool[self.value_index:self.value_index + 3]
+        self.value_index += 3
+        return values
 
     def random_level(self):
+        if self.p == 0.5:
+            # Each bit is a fair coin flip, so the number of trailing zeros is Geometric(0.5).
+            bits = random.getrandbits(self.max_level)
+            if bits == 0:
+                return self.max_level
+            return (bits & -bits).bit_length() - 1
         level = 0
         while random.random() < self.p and level < self.max_level:
             level += 1
         return level
 
-    def insert(self, key):
-        update = [None] * (self.max_level + 1)
-        current = self.header
-
+    def find_predecessors(self, key):
+        keys = self.keys
+        forward = self.forward
+        update = [HEADER] * (self.max_level + 1)
+        current = HEADER
         for i in range(self.level, -1, -1):
-            while current.forward[i] and current.forward[i].key < key:
-                current = current.forward[i]
+            nxt = forward[current][i]
+            while nxt and keys[nxt] < key:
+                current = nxt
+                nxt = forward[current][i]
             update[i] = current
+        return update
 
-        current = current.forward[0]
-        if current and current.key == key:
+    def insert(self, key):
+        update = self.find_predecessors(key)
+        forward = self.forward
+
+        node = forward[update[0]][0]
+        if node and self.keys[node] == key:
             return
 
         rlevel = self.random_level()
         if rlevel > self.level:
-            for i in range(self.level + 1, rlevel + 1):
-                update[i] = self.header
+            # update already holds HEADER for the levels above the current top.
             self.level = rlevel
 
-        values = [random.randint(0, 100) for _ in range(3)]
-        new_node = self.create_node(rlevel, key, values)
+        new_node = self.create_node(rlevel, key, self.next_values())
+        new_forward = forward[new_node]
         for i in range(rlevel + 1):
-            new_node.forward[i] = update[i].forward[i]
-            update[i].forward[i] = new_node
+            new_forward[i] = forward[update[i]][i]
+            forward[update[i]][i] = new_node
 
         self.size += 1
-        self.space_taken += sys.getsizeof(new_node) + sys.getsizeof(values)
 
     def delete(self, key: int) -> bool:
-        update = [None] * (self.max_level + 1)
-        current = self.header
-        deleted_space = 0
-
-        for i in range(self.level, -1, -1):
-            while current.forward[i] and current.forward[i].key < key:
-                current = current.forward[i]
-            update[i] = current
+        update = self.find_predecessors(key)
+        forward = self.forward
 
-        current = current.forward[0]
-        if current and current.key == key:
+        node = forward[update[0]][0]
+        if node and self.keys[node] == key:
+            node_forward = forward[node]
             for i in range(self.level + 1):
-                if update[i].forward[i] != current:
+                if forward[update[i]][i] != node:
                     break
-                update[i].forward[i] = current.forward[i]
+                forward[update[i]][i] = node_forward[i]
 
-            while self.level > 0 and self.header.forward[self.level] is None:
+            while self.level > 0 and forward[HEADER][self.level] == 0:
                 self.level -= 1
 
-            deleted_space += sys.getsizeof(current) + sys.getsizeof(current.values)
-            self.space_taken -= deleted_space
+            self.values[node] = None
+            forward[node] = None
+            self.free_ids.append(node)
             self.size -= 1
             return True
         else:
             return False
 
     def search(self, key):
-        current = self.header
-        for i in range(self.level, 1, -1):
-            while current.forward[i] and current.forward[i].key < key:
-                current = current.forward[i]
+        keys = self.keys
+        forward = self.forward
+        current = HEADER
+        for i in range(self.level, -1, -1):
+            nxt = forward[current][i]
+            while nxt and keys[nxt] < key:
+                current = nxt
+                nxt = forward[current][i]
 
-        current = current.forward[0]
-        if current and current.key == key:
-            return current.values
+        node = forward[current][0]
+        if node and keys[node] == key:
+            return self.values[node]
 
         return None
 
     def display_list(self):
         # print("Skip List Levels: ", self.level)
         for lvl in range(self.level + 1):
-            node = self.header.forward[lvl]
+            node = self.forward[HEADER][lvl]
             line = ""
             while node:
-                line += f"Key: {node.key}, Values: {node.values} "
-                node = node.forward[lvl]
+                line += f"Key: {self.keys[node]}, Values: {self.values[node]} "
+                node = self.forward[node][lvl]
             # print("Level " + str(lvl) + ": " + line)
 
     def free(self):
         print("Space taken: ", self.space_taken, " bytes")
-        self.header = self.create_node(self.max_level, None, None)
+        self.keys = array('q')
+        self.values = []
+        self.forward = []
+        self.free_ids = []
+        self.create_node(self.max_level)
         self.level = 0
-        self.space_taken = sys.getsizeof(self.header)
+        self.header_bytes = sys.getsizeof(self.forward[HEADER])
         self.size = 0
 
     def range_query(self, low, high):
         result = []
-        current = self.header
+        keys = self.keys
+        forward = self.forward
+        current = HEADER
         for i in range(self.level, -1, -1):
-            while current.forward[i] and current.forward[i].key < low:
-                current = current.forward[i]
-
-        current = current.forward[0]
-        while current and low <= current.key <= high:
-            result.append((current.key, current.values))
-            current = current.forward[0]
+            nxt = forward[current][i]
+            while nxt and keys[nxt] < low:
+                current = nxt
+                nxt = forward[current][i]
+
+        node = forward[current][0]
+        while node and low <= keys[node] <= high:
+            result.append((keys[node], self.values[node]))
+            node = forward[node][0]
         size = sys.getsizeof(result)
         print('The space for range query' , size ,"bytes")
         return result
@@ -131,12 +189,14 @@ skip_list = SkipList()
 num_values_to_insert = int(input("Enter the number of random values to insert: "))
 insertion_space = 0
 start_time = time.time()
-with tqdm(total=num_values_to_insert) as pbar:
-    for _ in range(num_values_to_insert):
-        random_key = random.randint(0, 5000) #change
-        #random_key = random.randint(0, 500)
-        skip_list.insert(random_key)
-        pbar.update(1)
+with tqdm(total=num_values_to_insert, mininterval=0.5) as pbar:
+    for start in range(0, num_values_to_insert, PROGRESS_CHUNK):
+        batch = min(PROGRESS_CHUNK, num_values_to_insert - start)
+        for _ in range(batch):
+            random_key = random.randint(0, 5000) #change
+            #random_key = random.randint(0, 500)
+            skip_list.insert(random_key)
+        pbar.update(batch)
 end_time = time.time()
 skip_list.display_list()
 print()
@@ -152,13 +212,14 @@ num_values_to_delete = int(input("Enter the number of random values to delete: "
 deleted_values = []
 deleted_space = 0
 start_time = time.time()
-with tqdm(total=num_values_to_delete) as pbar:
-    for _ in range(num_values_to_delete):
-        key_to_delete = random.randint(0, 1000) #change
-        if skip_list.delete(key_to_delete):
-            deleted_values.append(key_to_delete)
-  # Assuming key size is representative of node size
-        pbar.update(1)
+with tqdm(total=num_values_to_delete, mininterval=0.5) as pbar:
+    for start in range(0, num_values_to_delete, PROGRESS_CHUNK):
+        batch = min(PROGRESS_CHUNK, num_values_to_delete - start)
+        for _ in range(batch):
+            key_to_delete = random.randint(0, 1000) #change
+            if skip_list.delete(key_to_delete):
+                deleted_values.append(key_to_delete)
+        pbar.update(batch)
 end_time = time.time()
 print("Deleted values: ", deleted_values)
 print("Time taken to delete multiple values: ", end_time - start_time, "seconds")
@@ -169,16 +230,18 @@ print("Space taken after deletion: ", skip_list.space_taken, "bytes")
 num_values_to_search = int(input("Enter the number of random values to search: "))
 start_time = time.time()
 results=[]
-with tqdm(total=num_values_to_search) as pbar:
-    for _ in range(num_values_to_search):
-        search_value = random.randint(0, 1500) #change
-        search_result = skip_list.search(search_value)
-        if search_result:
-            results.append(search_value)
-            print(f"Value {search_value} Found with values: {search_result}")
-        else:
-            print(f"Value {search_value} NOT FOUND")
-        pbar.update(1)
+with tqdm(total=num_values_to_search, mininterval=0.5) as pbar:
+    for start in range(0, num_values_to_search, PROGRESS_CHUNK):
+        batch = min(PROGRESS_CHUNK, num_values_to_search - start)
+        for _ in range(batch):
+            search_value = random.randint(0, 1500) #change
+            search_result = skip_list.search(search_value)
+            if search_result:
+                results.append(search_value)
+                print(f"Value {search_value} Found with values: {search_result}")
+            else:
+                print(f"Value {search_value} NOT FOUND")
+        pbar.update(batch)
 end_time = time.time()
 print("Time taken to search for multiple values: ", end_time - start_time, "seconds")
 size = sys.getsizeof(results)